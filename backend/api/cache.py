@@ -0,0 +1,96 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Tag
+
+RECIPE_GENERATION_KEY = 'recipe:generation'
+TAGS_KEY = 'tags:ids'
+
+
+def get_version(key):
+    """
+    Версия общих данных в кэше. Без общего кэша версия живёт
+    CACHE_VERSION_TIMEOUT секунд, что ограничивает устаревание копий
+    в других процессах.
+    """
+    return cache.get_or_set(
+        key, time.time_ns, timeout=settings.CACHE_VERSION_TIMEOUT
+    )
+
+
+def bump_version(key):
+    cache.set(key, time.time_ns(), timeout=settings.CACHE_VERSION_TIMEOUT)
+
+
+def get_recipe_generation():
+    return get_version(RECIPE_GENERATION_KEY)
+
+
+def recipe_key(recipe, generation):
+    """Ключ по версии рецепта: изменения рецепта меняют updated_at"""
+    return (
+        f'recipe:{generation}:{recipe.pk}:{recipe.updated_at.isoformat()}'
+    )
+
+
+def get_cached_recipes(recipes):
+    """Общие для всех пользователей представления рецептов по id"""
+    generation = get_recipe_generation()
+    keys = {recipe_key(recipe, generation): recipe.pk for recipe in recipes}
+    cached = cache.get_many(keys)
+    return {keys[key]: data for key, data in cached.items()}
+
+
+def set_cached_recipes(recipes, representations):
+    generation = get_recipe_generation()
+    cache.set_many(
+        {
+            recipe_key(recipe, generation): representations[recipe.pk]
+            for recipe in recipes
+        },
+        timeout=settings.RECIPE_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_all_recipes():
+    """Сброс кэша всех рецептов сменой поколения ключей"""
+
+    transaction.on_commit(lambda: bump_version(RECIPE_GENERATION_KEY))
+
+
+def feed_key(user_id):
+    return f'feed:head:{user_id}'
+
+
+def get_cached_feed_head(user_id, limit):
+    """Первая страница ленты подписок пользователя: id рецептов и ссылка"""
+    return cache.get(feed_key(user_id), {}).get(limit)
+
+
+def set_cached_feed_head(user_id, limit, head):
+    heads = cache.get(feed_key(user_id), {})
+    heads[limit] = head
+    cache.set(feed_key(user_id), heads, settings.FEED_CACHE_TIMEOUT)
+
+
+def invalidate_feeds(user_ids):
+    """Сброс кэша лент подписчиков после фиксации транзакции"""
+    keys = [feed_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_tag_ids():
+    """Словарь {slug: id} всех тегов"""
+    tags = cache.get(TAGS_KEY)
+    if tags is None:
+        tags = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(TAGS_KEY, tags, timeout=settings.CACHE_VERSION_TIMEOUT)
+    return tags
+
+
+def invalidate_tags():
+    transaction.on_commit(lambda: cache.delete(TAGS_KEY))
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from api.cache import bump_version, get_version
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+
+class Catalogue:
+    """
+    Полный список объектов, заранее отрендеренный в JSON и хранимый
+    в памяти процесса. Версия хранится в общем кэше, поэтому сигнал
+    в одном процессе сбрасывает копии во всех остальных.
+    """
+
+    def __init__(self, name, queryset, serializer_class):
+        self.version_key = f'catalogue:{name}'
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self._lock = threading.Lock()
+        self._data = None
+
+    def get_version(self):
+        return get_version(self.version_key)
+
+    def invalidate(self):
+        transaction.on_commit(lambda: bump_version(self.version_key))
+
+    def _build(self, version):
+        serializer = self.serializer_class(self.queryset.all(), many=True)
+        content = JSONRenderer().render(serializer.data)
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        return version, content, etag, version // 10 ** 9
+
+    @property
+    def data(self):
+        version = self.get_version()
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                if self._data is None or self._data[0] != version:
+                    self._data = self._build(version)
+                data = self._data
+        return data
+
+    def response(self, request):
+        """Ответ со списком или 304, если у клиента актуальная копия"""
+        _, content, etag, last_modified = self.data
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        return get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified,
+            response=response,
+        )
+
+
+tag_catalogue = Catalogue('tags', Tag.objects.all(), TagSerializer)
+ingredient_catalogue = Catalogue(
+    'ingredients', Ingredient.objects.all(), IngredientSerializer
+)
@@ -0,0 +1,87 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def absolute_uri(request, url):
+    return request.build_absolute_uri(url) if request and url else url
+
+
+def absolute_variant_urls(request, urls):
+    return {
+        name: {
+            variant_format: absolute_uri(request, url)
+            for variant_format, url in formats.items()
+        }
+        for name, formats in urls.items()
+    }
+
+
+class HeaderImageField(serializers.ImageField):
+    """
+    Изображение, проверяемое по заголовку файла: формат, размер файла
+    и число пикселей. Пиксели не декодируются, файл не копируется в память.
+    """
+
+    default_error_messages = {
+        'too_large': 'Размер файла не должен превышать {max_size} МБ.',
+        'too_many_pixels': (
+            'Изображение не должно содержать более {max_pixels} пикселей.'
+        ),
+    }
+
+    def to_internal_value(self, data):
+        file = serializers.FileField.to_internal_value(self, data)
+        if file.size > settings.MAX_IMAGE_SIZE:
+            self.fail('too_large', max_size=settings.MAX_IMAGE_SIZE >> 20)
+        try:
+            with Image.open(file) as image:
+                image_format, (width, height) = image.format, image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        finally:
+            file.seek(0)
+        if image_format not in IMAGE_FORMATS:
+            self.fail('invalid_image')
+        if width * height > settings.MAX_IMAGE_PIXELS:
+            self.fail('too_many_pixels', max_pixels=settings.MAX_IMAGE_PIXELS)
+        file.name = '{}.{}'.format(
+            os.path.splitext(file.name)[0], IMAGE_FORMATS[image_format]
+        )
+        file.content_type = Image.MIME[image_format]
+        return file
+
+
+class RecipeImageField(Base64ImageField, HeaderImageField):
+    """Изображение рецепта: base64-строка в JSON или файл multipart-формы"""
+
+    ALLOWED_TYPES = tuple(IMAGE_FORMATS.values()) + ('jpeg',)
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return HeaderImageField.to_internal_value(self, data)
+        if isinstance(data, str) and (
+            len(data) * 3 // 4 > settings.MAX_IMAGE_SIZE
+        ):
+            self.fail('too_large', max_size=settings.MAX_IMAGE_SIZE >> 20)
+        return super().to_internal_value(data)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии изображения по размерам и форматам"""
+
+    def to_representation(self, value):
+        return absolute_variant_urls(self.context.get('request'), {
+            name: {
+                variant_format: default_storage.url(path)
+                for variant_format, path in formats.items()
+            }
+            for name, formats in value.get('files', {}).items()
+        })
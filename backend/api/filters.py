@@ -1,21 +1,57 @@
 import django_filters
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, When
+from django.db.models.functions import Upper
 from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Ingredient, Recipe
+from api.cache import get_tag_ids
+from api.search import ingredient_index
+from recipes.models import Favorites, Ingredient, Recipe, ShoppingCart
 
 
 class IngredientsSearchFilter(django_filters.FilterSet):
-    """Фильтр для поиска по частичному названию ингредиента"""
+    """
+    Фильтр для поиска по частичному названию ингредиента.
+    Параметр search ищет также по вхождению и с опечатками.
+    """
 
     name = django_filters.CharFilter(
         field_name="name",
         lookup_expr="istartswith",
     )
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Ingredient
         fields = ("name",)
 
+    def filter_search(self, queryset, name, value):
+        if connections[queryset.db].vendor != 'postgresql':
+            ids = [item['id'] for item in ingredient_index.search(value)]
+            return queryset.filter(pk__in=ids).order_by(Case(
+                *[When(pk=pk, then=position)
+                  for position, pk in enumerate(ids)],
+                output_field=IntegerField(),
+            ))
+        return queryset.annotate(
+            upper_name=Upper('name'),
+            similarity=TrigramSimilarity(Upper('name'), value),
+            rank=Case(
+                When(name__istartswith=value, then=0),
+                When(name__icontains=value, then=1),
+                default=2,
+                output_field=IntegerField(),
+            ),
+        ).filter(
+            Q(name__icontains=value) | Q(upper_name__trigram_similar=value)
+        ).order_by('rank', '-similarity', 'name')
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
+
 
 class RecipeAndTagsFilter(filters.FilterSet):
     """Фильтр для рецептов, списка покупок, избранного"""
@@ -24,18 +60,46 @@ class RecipeAndTagsFilter(filters.FilterSet):
         method='filter_is_in_shopping_cart'
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags',
+    )
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        tag_ids = get_tag_ids()
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tag_id__in=[tag_ids[slug] for slug in value],
+            )
+        ))
+
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(Exists(Favorites.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            )))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            )))
         return queryset
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """Сортировка рецептов; id в конце делает порядок однозначным"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('-id')
+        return ordering
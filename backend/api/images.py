@@ -0,0 +1,144 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+from recipes.storage import recipe_image_storage
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/variants'
+_executor = None
+
+
+def get_formats():
+    """Форматы вариантов, поддерживаемые установленным Pillow"""
+    Image.init()
+    return [
+        variant_format for variant_format in settings.IMAGE_VARIANT_FORMATS
+        if variant_format.upper() in Image.SAVE
+    ]
+
+
+def variant_files(stem):
+    """
+    Пути вариантов изображения по имени исходного файла. Имя исходника -
+    хэш содержимого, поэтому рецепты с одним изображением делят варианты.
+    """
+    return {
+        name: {
+            variant_format: f'{VARIANTS_DIR}/{stem}_{name}.{variant_format}'
+            for variant_format in get_formats()
+        }
+        for name in settings.IMAGE_VARIANT_SIZES
+    }
+
+
+def save_variant(path, content):
+    if default_storage.exists(path):
+        return
+    saved = default_storage.save(path, ContentFile(content))
+    if saved != path:
+        # тот же вариант одновременно сохранила другая обработка
+        default_storage.delete(saved)
+
+
+def render_variants(image, files):
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    for name, size in settings.IMAGE_VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for variant_format, path in files[name].items():
+            if default_storage.exists(path):
+                continue
+            buffer = io.BytesIO()
+            resized.save(
+                buffer,
+                variant_format.upper(),
+                quality=settings.IMAGE_VARIANT_QUALITY[variant_format],
+            )
+            save_variant(path, buffer.getvalue())
+
+
+def release_images(names):
+    """
+    Удаление изображений и их вариантов, на которые больше
+    не ссылаются рецепты
+    """
+    names = {name for name in names if name}
+    referenced = set(
+        Recipe.objects.filter(image__in=names).values_list('image', flat=True)
+    )
+    for name in names - referenced:
+        if recipe_image_storage.exists(name) and recipe_image_storage.is_stale(
+            name, settings.IMAGE_GC_GRACE
+        ):
+            recipe_image_storage.delete(name)
+            stem = os.path.splitext(os.path.basename(name))[0]
+            for formats in variant_files(stem).values():
+                for path in formats.values():
+                    default_storage.delete(path)
+
+
+def generate_variants(recipe_id):
+    """Уменьшенные копии изображения рецепта в форматах WebP/AVIF"""
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'image_variants'
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    files = variant_files(os.path.splitext(os.path.basename(source))[0])
+    if not all(
+        default_storage.exists(path)
+        for formats in files.values() for path in formats.values()
+    ):
+        largest = max(settings.IMAGE_VARIANT_SIZES.values())
+        with recipe.image.open('rb') as file, Image.open(file) as image:
+            image.draft('RGB', largest)
+            render_variants(image, files)
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        image_variants={'source': source, 'files': files},
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        release_images([source])
+
+
+def run_generate_variants(recipe_id):
+    try:
+        generate_variants(recipe_id)
+    except Exception:
+        logger.exception('Ошибка обработки изображения рецепта %s', recipe_id)
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    return _executor
+
+
+def schedule_variants(recipe):
+    """Обработка изображения в фоне после фиксации транзакции"""
+    if not recipe.image or (
+        recipe.image_variants.get('source') == recipe.image.name
+    ):
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(run_generate_variants, recipe.pk)
+    )
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.search import ingredient_index
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    """
+    Команда 'benchmark_ingredient_search' сравнивает время поиска
+    ингредиентов по префиксу в БД и в индексе в памяти.
+    """
+
+    help = 'benchmark ingredient prefix search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--prefixes', nargs='+',
+            default=['а', 'ка', 'мол', 'сли', 'сок', 'я'],
+        )
+
+    def measure(self, search, prefixes, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for prefix in prefixes:
+                search(prefix)
+        calls = repeat * len(prefixes)
+        return (time.perf_counter() - started) / calls * 1000
+
+    def handle(self, *args, **options):
+        prefixes = options['prefixes']
+        repeat = options['repeat']
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+
+        def database(prefix):
+            return list(Ingredient.objects.filter(
+                name__istartswith=prefix
+            ).values('id', 'name', 'measurement_unit')[:limit])
+
+        def memory(prefix):
+            return ingredient_index.search_prefix(prefix, limit)
+
+        started = time.perf_counter()
+        ingredient_index.invalidate()
+        ingredient_index.data
+        build = (time.perf_counter() - started) * 1000
+
+        self.stdout.write(f'Построение индекса: {build:.2f} мс')
+        self.stdout.write(
+            f'БД: {self.measure(database, prefixes, repeat):.3f} мс/запрос'
+        )
+        self.stdout.write(
+            f'Память: {self.measure(memory, prefixes, repeat):.3f} мс/запрос'
+        )
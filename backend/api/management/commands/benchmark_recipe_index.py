@@ -0,0 +1,108 @@
+import random
+import statistics
+import sys
+import time
+from array import array
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.search import build_postings, rank_recipes, replace_recipe
+
+PAGE_SIZE = 6
+
+
+class Command(BaseCommand):
+    """
+    Команда 'benchmark_recipe_index' измеряет индекс «ингредиент → рецепты»
+    на синтетических данных в памяти: построение, размер, подбор рецептов
+    по ингредиентам и замену ингредиентов рецепта. БД не используется.
+    """
+
+    help = 'benchmark the ingredient to recipes index on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--have', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def generate(self, recipes, ingredients, rnd):
+        """
+        Пары (ингредиент, рецепт) в порядке построения индекса. Частота
+        ингредиентов убывает по закону Ципфа, в рецепте 4-12 ингредиентов.
+        """
+        population = range(1, ingredients + 1)
+        weights = list(accumulate(
+            1 / number ** 0.8 for number in population
+        ))
+        rows = []
+        for recipe_id in range(1, recipes + 1):
+            chosen = set(rnd.choices(
+                population, cum_weights=weights, k=rnd.randint(4, 12)
+            ))
+            rows.extend((ingredient_id, recipe_id) for ingredient_id in chosen)
+        rows.sort()
+        return rows
+
+    def report(self, label, timings):
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{label}: медиана {statistics.median(timings):.2f} мс, '
+            f'p95 {p95:.2f} мс'
+        )
+
+    def measure(self, call, arguments):
+        timings = []
+        for argument in arguments:
+            started = time.perf_counter()
+            call(argument)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def handle(self, *args, **options):
+        recipes = options['recipes']
+        ingredients = options['ingredients']
+        queries = options['queries']
+        rnd = random.Random(options['seed'])
+        rows = self.generate(recipes, ingredients, rnd)
+
+        started = time.perf_counter()
+        postings, sizes = build_postings(iter(rows))
+        build = time.perf_counter() - started
+        size = sum(map(sys.getsizeof, postings.values()))
+        size += sys.getsizeof(sizes)
+        self.stdout.write(
+            f'Рецептов: {recipes}, записей: {len(rows)}, '
+            f'построение {build:.2f} с, {size / 2 ** 20:.1f} МБ'
+        )
+
+        def query(ingredient_ids):
+            ranked = rank_recipes(postings, sizes, ingredient_ids)
+            len(ranked)
+            ranked[:PAGE_SIZE]
+
+        have = min(options['have'], settings.COOK_INGREDIENTS_LIMIT)
+        common = range(1, min(ingredients, 50) + 1)
+        for label, pool in (
+            ('Частые ингредиенты', common),
+            ('Любые ингредиенты', range(1, ingredients + 1)),
+        ):
+            self.report(label, self.measure(query, [
+                rnd.sample(pool, min(have, len(pool)))
+                for _ in range(queries)
+            ]))
+
+        def update(recipe_id):
+            # как в apply_recipes: изменения вносятся в копию индекса
+            replace_recipe(
+                dict(postings), array('H', sizes), recipe_id,
+                rnd.sample(range(1, ingredients + 1), 8),
+            )
+
+        self.report('Замена рецепта', self.measure(update, [
+            rnd.randint(1, recipes) for _ in range(queries)
+        ]))
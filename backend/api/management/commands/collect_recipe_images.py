@@ -0,0 +1,58 @@
+import posixpath
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import VARIANTS_DIR
+from recipes.models import Recipe
+from recipes.storage import recipe_image_storage
+
+
+class Command(BaseCommand):
+    """
+    Команда 'collect_recipe_images' удаляет файлы изображений рецептов
+    и их вариантов, на которые не ссылается ни один рецепт. Файлы моложе
+    --grace секунд не трогаются: они могут принадлежать незавершённой
+    загрузке.
+    """
+
+    help = 'delete unreferenced recipe image files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=settings.IMAGE_GC_GRACE
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def get_referenced(self):
+        referenced = set()
+        for image, image_variants in Recipe.objects.values_list(
+            'image', 'image_variants'
+        ).iterator():
+            referenced.add(image)
+            for formats in image_variants.get('files', {}).values():
+                referenced.update(formats.values())
+        return referenced
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        referenced = self.get_referenced()
+        image_dir = Recipe._meta.get_field('image').upload_to.rstrip('/')
+        deleted = freed = 0
+        for directory in (image_dir, VARIANTS_DIR):
+            if not storage.exists(directory):
+                continue
+            for filename in storage.listdir(directory)[1]:
+                name = posixpath.join(directory, filename)
+                if name in referenced or not storage.is_stale(
+                    name, options['grace']
+                ):
+                    continue
+                deleted += 1
+                freed += storage.size(name)
+                if not options['dry_run']:
+                    storage.delete(name)
+        self.stdout.write(
+            f'Удалено файлов: {deleted}, освобождено: {freed >> 10} КБ'
+            + (' (пробный запуск)' if options['dry_run'] else '')
+        )
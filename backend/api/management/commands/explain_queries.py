@@ -0,0 +1,199 @@
+import random
+import re
+from uuid import uuid4
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.views import RecipeViewSet
+from recipes.models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+from users.views import UsersViewSet
+
+FULL_SCAN = re.compile(
+    r'Seq Scan on (?P<pg>\w+)|SCAN (?P<sqlite>\w+)(?! USING)(?!\w)'
+)
+WATCHED_TABLES = {
+    'recipes_recipe', 'recipes_favorites', 'recipes_shoppingcart',
+    'recipes_ingredientforrecipe', 'recipes_recipe_tags', 'users_follow',
+    'recipes_shoppingcartingredient',
+}
+
+
+class Command(BaseCommand):
+    """
+    Команда 'explain_queries' выводит планы запросов основных списков API
+    (EXPLAIN ANALYZE в PostgreSQL) и предупреждает о полном просмотре
+    крупных таблиц. С --seed база предварительно заполняется тестовыми
+    данными в транзакции, которая затем откатывается.
+    """
+
+    help = 'explain main list endpoint queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='количество тестовых рецептов'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя для персональных запросов'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            user = self.get_user(options['user'])
+            for title, queryset in self.get_querysets(user):
+                self.explain(title, queryset)
+            transaction.set_rollback(True)
+
+    def get_user(self, user_id):
+        if user_id:
+            user = User.objects.filter(pk=user_id).first()
+            if user is None:
+                raise CommandError(f'Пользователь {user_id} не найден.')
+            return user
+        follow = Follow.objects.select_related('user').order_by('?').first()
+        if follow is None:
+            raise CommandError(
+                'В базе нет подписок: укажите --user или --seed.'
+            )
+        return follow.user
+
+    def get_view(self, viewset_class, path, user):
+        request = Request(APIRequestFactory().get(path))
+        request.user = user
+        return viewset_class(
+            request=request, action='list', format_kwarg=None, kwargs={}
+        )
+
+    def recipes(self, path, user):
+        view = self.get_view(RecipeViewSet, path, user)
+        return view.filter_queryset(view.get_queryset())[:6]
+
+    def get_querysets(self, user):
+        tags = '&'.join(
+            f'tags={slug}' for slug in
+            Tag.objects.values_list('slug', flat=True)[:3]
+        )
+        author = Recipe.objects.values_list('author', flat=True).first()
+        feed_view = self.get_view(RecipeViewSet, '/api/recipes/feed/', user)
+        users_view = self.get_view(UsersViewSet, '/api/users/', user)
+        return (
+            ('Рецепты (аноним)',
+             self.recipes('/api/recipes/', AnonymousUser())),
+            ('Рецепты', self.recipes('/api/recipes/', user)),
+            ('Рецепты по тегам', self.recipes(f'/api/recipes/?{tags}', user)),
+            ('Избранное',
+             self.recipes('/api/recipes/?is_favorited=1', user)),
+            ('Список покупок',
+             self.recipes('/api/recipes/?is_in_shopping_cart=1', user)),
+            ('Рецепты автора', self.recipes(
+                f'/api/recipes/?author={author}', user
+            )),
+            ('Лента подписок',
+             feed_view.get_feed_queryset(user).order_by('-pub_date', '-id')
+             [:6]),
+            ('Подписки', users_view.get_subscriptions_queryset(user)[:6]),
+            ('Скачивание списка покупок',
+             user.shopping_cart_ingredients.order_by('ingredient__name')),
+        )
+
+    def explain(self, title, queryset):
+        analyze = connection.vendor == 'postgresql'
+        plan = queryset.explain(analyze=analyze) if analyze else (
+            queryset.explain()
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(plan)
+        for match in FULL_SCAN.finditer(plan):
+            table = match.group('pg') or match.group('sqlite')
+            if table in WATCHED_TABLES:
+                self.stdout.write(self.style.WARNING(
+                    f'Полный просмотр таблицы {table}'
+                ))
+        self.stdout.write('')
+
+    def seed(self, count):
+        """Тестовые авторы, рецепты, подписки, избранное и корзины"""
+        prefix = f'seed-{uuid4().hex[:8]}-'
+        users = User.objects.bulk_create(
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@seed.local',
+            )
+            for number in range(max(count // 10, 2))
+        )
+        if users[0].pk is None:
+            # SQLite в Django 3.2 не возвращает id из bulk_create
+            users = list(User.objects.filter(username__startswith=prefix))
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=random.choice(users),
+                    image='recipes/1.jpg',
+                    name=f'{prefix}{number}',
+                    text='Описание',
+                    cooking_time=random.randint(1, 120),
+                )
+                for number in range(count)
+            ),
+            batch_size=1000,
+        )
+        recipe_ids = [recipe.pk for recipe in recipes]
+        if recipe_ids[0] is None:
+            recipe_ids = list(Recipe.objects.filter(
+                name__startswith=prefix
+            ).values_list('pk', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        IngredientForRecipe.objects.bulk_create(
+            (
+                IngredientForRecipe(
+                    recipe_id=recipe_id, ingredient_id=ingredient_id,
+                    amount=random.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in random.sample(ingredient_ids, 5)
+            ),
+            batch_size=1000,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in random.sample(tag_ids, min(2, len(tag_ids)))
+            ),
+            batch_size=1000,
+        )
+        for model in (Follow, Favorites, ShoppingCart):
+            self.seed_user_links(model, users, recipe_ids)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def seed_user_links(self, model, users, recipe_ids):
+        objects = []
+        for user in users:
+            if model is Follow:
+                authors = random.sample(users, min(20, len(users)))
+                objects += [
+                    Follow(user=user, author=author)
+                    for author in authors if author != user
+                ]
+            else:
+                objects += [
+                    model(user=user, recipe_id=recipe_id)
+                    for recipe_id in random.sample(
+                        recipe_ids, min(10, len(recipe_ids))
+                    )
+                ]
+        model.objects.bulk_create(
+            objects, batch_size=1000, ignore_conflicts=True
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from api.images import generate_variants, get_formats
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Команда 'generate_image_variants' создаёт уменьшенные копии
+    изображений рецептов, для которых их ещё нет (или всех с --force).
+    """
+
+    help = 'generate resized recipe image variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', type=int, nargs='+')
+        parser.add_argument('--force', action='store_true')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'image', 'image_variants'
+        )
+        if options['recipe']:
+            recipes = recipes.filter(pk__in=options['recipe'])
+        self.stdout.write('Форматы: {}'.format(', '.join(get_formats())))
+        processed = failed = 0
+        for recipe in recipes.iterator():
+            if not options['force'] and (
+                recipe.image_variants.get('source') == recipe.image.name
+            ):
+                continue
+            try:
+                generate_variants(recipe.pk)
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe.pk}: {error}')
+            else:
+                processed += 1
+        self.stdout.write(
+            f'Обработано рецептов: {processed}, с ошибками: {failed}'
+        )
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.search import recipe_ingredient_index
+
+
+class Command(BaseCommand):
+    """
+    Команда 'rebuild_recipe_index' строит индекс «ингредиент → рецепты»
+    и меняет его версию в кэше: процессы приложения перестроят свои копии
+    при следующем запросе.
+    """
+
+    help = 'rebuild the ingredient to recipes index'
+
+    def handle(self, *args, **options):
+        recipe_ingredient_index.rebuild()
+        started = time.monotonic()
+        _, postings, sizes = recipe_ingredient_index.data
+        self.stdout.write(
+            'Ингредиентов: {}, рецептов: {}, записей: {}, {:.2f} с'.format(
+                len(postings),
+                len(sizes) - sizes.count(0),
+                sum(map(len, postings.values())),
+                time.monotonic() - started,
+            )
+        )
@@ -1,6 +1,102 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class SetCustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+def estimate_count(model, using):
+    """Оценка числа строк таблицы по статистике планировщика PostgreSQL"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Количество объектов кэшируется по нормализованному запросу.
+    Для большой нефильтрованной таблицы берётся оценка планировщика.
+    """
+
+    count_is_exact = True
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = queryset.order_by().values('pk').query
+        if not query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if (estimate is not None
+                    and estimate > settings.PAGINATION_ESTIMATE_THRESHOLD):
+                self.count_is_exact = False
+                return estimate
+        try:
+            sql = str(query)
+        except EmptyResultSet:
+            return 0
+        key = 'count:' + hashlib.sha1(sql.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class CachedCountPagination(SetCustomPagination):
+    django_paginator_class = CachedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_exact'] = self.page.paginator.count_is_exact
+        return response
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная пагинация по (pub_date, id) без подсчёта количества"""
+
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-pub_date', '-id')
+
+
+class RecipePagination(CachedCountPagination):
+    """
+    Постраничный вывод рецептов. Параметр 'cursor' в запросе
+    (в том числе пустой) включает курсорный режим.
+    """
+
+    cursor_pagination_class = RecipeCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
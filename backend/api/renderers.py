@@ -0,0 +1,34 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class PlainTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return ''
+        if isinstance(data, dict):
+            return '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(BaseRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''
+
+
+SHOPPING_LIST_RENDERERS = (
+    PlainTextRenderer, CSVRenderer, JSONRenderer, PDFRenderer,
+)
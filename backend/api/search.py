@@ -0,0 +1,331 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from itertools import chain, groupby
+from operator import itemgetter, neg, truediv
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api.cache import bump_version, get_version
+from recipes.models import Ingredient, IngredientForRecipe
+
+SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(text):
+    """Триграммы слов строки, как в pg_trgm"""
+    grams = set()
+    for word in re.findall(r'\w+', text.casefold()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class IngredientIndex:
+    """
+    Отсортированный и триграммный индексы ингредиентов в памяти процесса.
+    Строятся при первом обращении; версия хранится в общем кэше, поэтому
+    изменения ингредиентов в любом процессе сбрасывают копии во всех.
+    """
+
+    version_key = 'index:ingredients'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def invalidate(self):
+        transaction.on_commit(lambda: bump_version(self.version_key))
+
+    def _build(self):
+        entries = sorted(
+            (name.casefold(), pk, name, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = [entry[0] for entry in entries]
+        items = [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for _, pk, name, unit in entries
+        ]
+        postings = {}
+        sizes = []
+        for position, key in enumerate(keys):
+            grams = trigrams(key)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+        return keys, items, postings, sizes
+
+    @property
+    def data(self):
+        version = get_version(self.version_key)
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                if self._data is None or self._data[0] != version:
+                    self._data = version, self._build()
+                data = self._data
+        return data[1]
+
+    def _prefix_positions(self, keys, prefix):
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        return sorted(
+            range(start, end),
+            key=lambda position: (keys[position] != prefix,
+                                  len(keys[position]), position)
+        )
+
+    def _similar_positions(self, data, value):
+        _, _, postings, sizes = data
+        grams = trigrams(value)
+        shared = Counter()
+        for gram in grams:
+            shared.update(postings.get(gram, ()))
+        scores = (
+            (count / (len(grams) + sizes[position] - count), position)
+            for position, count in shared.items()
+        )
+        return [
+            position for score, position in sorted(
+                scores, key=lambda item: (-item[0], item[1])
+            )
+            if score >= SIMILARITY_THRESHOLD
+        ]
+
+    def search_prefix(self, prefix, limit=None):
+        """Ингредиенты с названием, начинающимся с prefix, по релевантности"""
+        keys, items, _, _ = self.data
+        positions = self._prefix_positions(keys, prefix.casefold())
+        return [items[position] for position in positions[:limit]]
+
+    def search(self, value, limit=None):
+        """
+        Ингредиенты по релевантности: сначала совпадения по началу названия,
+        затем по вхождению подстроки, затем похожие по триграммам.
+        """
+        data = self.data
+        keys, items, _, _ = data
+        value = value.casefold()
+        positions = self._prefix_positions(keys, value)
+        found = set(positions)
+        positions += sorted(
+            (
+                position for position, key in enumerate(keys)
+                if value in key and position not in found
+            ),
+            key=lambda position: (len(keys[position]), position)
+        )
+        found.update(positions)
+        positions += [
+            position for position in self._similar_positions(data, value)
+            if position not in found
+        ]
+        return [items[position] for position in positions[:limit]]
+
+
+ingredient_index = IngredientIndex()
+
+
+def build_postings(rows):
+    """
+    Списки рецептов по ингредиентам из пар (ingredient_id, recipe_id),
+    упорядоченных по ингредиенту и рецепту, и число ингредиентов рецептов.
+    """
+    postings = {
+        ingredient_id: array('I', map(itemgetter(1), group))
+        for ingredient_id, group in groupby(rows, key=itemgetter(0))
+    }
+    counts = Counter(chain.from_iterable(postings.values()))
+    sizes = array('H', bytes(2 * (max(counts, default=0) + 1)))
+    for recipe_id, count in counts.items():
+        sizes[recipe_id] = count
+    return postings, sizes
+
+
+def replace_recipe(postings, sizes, recipe_id, ingredient_ids):
+    """
+    Замена ингредиентов рецепта в индексе на месте. Для индекса, который
+    уже читают другие потоки, вызывается на копиях (см. apply_recipes).
+    """
+    if recipe_id >= len(sizes):
+        sizes.extend(bytes(2 * (recipe_id + 1 - len(sizes))))
+    left = sizes[recipe_id]
+    for ingredient_id, recipes in postings.items():
+        if not left:
+            break
+        position = bisect.bisect_left(recipes, recipe_id)
+        if position < len(recipes) and recipes[position] == recipe_id:
+            postings[ingredient_id] = (
+                recipes[:position] + recipes[position + 1:]
+            )
+            left -= 1
+    for ingredient_id in ingredient_ids:
+        recipes = postings.get(ingredient_id, array('I'))
+        position = bisect.bisect_left(recipes, recipe_id)
+        postings[ingredient_id] = (
+            recipes[:position] + array('I', [recipe_id]) + recipes[position:]
+        )
+    sizes[recipe_id] = len(ingredient_ids)
+
+
+def apply_recipes(postings, sizes, recipe_ids):
+    """
+    Новый индекс с ингредиентами рецептов, перечитанными из БД.
+    Переданные словарь и массив не меняются: массивы рецептов
+    в replace_recipe заменяются срезами, а не правятся на месте.
+    """
+    ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+    for recipe_id, ingredient_id in IngredientForRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient_id'):
+        ingredients[recipe_id].append(ingredient_id)
+    postings, sizes = dict(postings), array('H', sizes)
+    for recipe_id, ingredient_ids in ingredients.items():
+        replace_recipe(postings, sizes, recipe_id, ingredient_ids)
+    return postings, sizes
+
+
+class RankedRecipes:
+    """
+    Id рецептов по убыванию доли имеющихся ингредиентов, затем по числу
+    совпавших ингредиентов и новизне. Поддерживает len() и срезы,
+    поэтому подходит для Paginator: сортируется только нужное начало.
+    """
+
+    def __init__(self, matched, sizes):
+        self.matched = matched
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.matched)
+
+    def __getitem__(self, key):
+        recipe_ids = list(self.matched)
+        counts = list(self.matched.values())
+        # ключи сравниваются кортежами без вызова Python-функции на элемент
+        ranked = heapq.nsmallest(key.stop, zip(
+            map(truediv, map(self.sizes.__getitem__, recipe_ids), counts),
+            map(neg, counts),
+            map(neg, recipe_ids),
+        ))
+        return [-recipe_id for _, _, recipe_id in ranked[key]]
+
+
+def rank_recipes(postings, sizes, ingredient_ids):
+    matched = Counter()
+    for ingredient_id in set(ingredient_ids):
+        matched.update(postings.get(ingredient_id, ()))
+    return RankedRecipes(matched, sizes)
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс «ингредиент → отсортированный массив id рецептов»
+    в памяти процесса. Версия хранится в общем кэше, а под каждой версией —
+    id изменённых рецептов: процессы, отставшие на несколько версий,
+    перечитывают из БД только эти рецепты в копию индекса и подменяют
+    ею прежнюю: потоки, уже получившие data, дочитывают старую версию
+    целиком. Полное перестроение нужно
+    при первом обращении, после rebuild() и когда журнал потерян.
+    """
+
+    version_key = 'index:recipe_ingredients'
+    max_changes = 1000
+    # сколько ждать запись журнала, которую ещё не успели сохранить
+    log_wait = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._missing = None
+
+    def get_version(self):
+        return get_version(self.version_key)
+
+    def log_key(self, version):
+        return f'{self.version_key}:changes:{version}'
+
+    def rebuild(self):
+        """Новая версия индекса для всех процессов"""
+        bump_version(self.version_key)
+
+    def _build(self, version):
+        rows = IngredientForRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        return (version, *build_postings(rows.iterator(chunk_size=10000)))
+
+    @property
+    def data(self):
+        version = self.get_version()
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                data = self._data
+                if data is None or not (
+                    0 <= version - data[0] <= self.max_changes
+                ):
+                    data = self._build(version)
+                elif data[0] != version:
+                    data = self._catch_up(data, version)
+                self._data = data
+        return data
+
+    def _catch_up(self, data, version):
+        """Применение изменений из журнала в кэше"""
+        current, postings, sizes = data
+        keys = [
+            self.log_key(number) for number in range(current + 1, version + 1)
+        ]
+        logged = cache.get_many(keys)
+        recipe_ids = set()
+        for key in keys:
+            if key not in logged:
+                break
+            recipe_ids.update(logged[key])
+            current += 1
+        if current < version and self._log_lost(current + 1):
+            return self._build(version)
+        if not recipe_ids:
+            return current, postings, sizes
+        return (current, *apply_recipes(postings, sizes, recipe_ids))
+
+    def _log_lost(self, number):
+        """Запись журнала вытеснена или так и не появилась"""
+        now = time.monotonic()
+        if self._missing is None or self._missing[0] != number:
+            self._missing = number, now
+        return now - self._missing[1] > self.log_wait
+
+    def refresh(self, recipe_ids):
+        """Запись изменённых рецептов в журнал после фиксации транзакции"""
+        recipe_ids = list(set(recipe_ids))
+        transaction.on_commit(lambda: self._log(recipe_ids))
+
+    def _log(self, recipe_ids):
+        try:
+            version = cache.incr(self.version_key)
+        except ValueError:
+            # версии нет в кэше: копии будут перестроены
+            return
+        cache.set(
+            self.log_key(version), recipe_ids,
+            timeout=settings.RECIPE_INDEX_LOG_TIMEOUT,
+        )
+
+    def rank(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ингредиентов"""
+        _, postings, sizes = self.data
+        return rank_recipes(postings, sizes, ingredient_ids)
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
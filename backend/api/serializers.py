@@ -1,14 +1,20 @@
+import json
+
+from django.conf import settings
 from django.db import models, transaction
-from django.db.models import F
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import (IntegerField, PrimaryKeyRelatedField,
                                         SerializerMethodField)
 
+from api.cache import get_cached_recipes, set_cached_recipes
+from api.fields import (ImageVariantsField, RecipeImageField, absolute_uri,
+                        absolute_variant_urls)
+from api.search import recipe_ingredient_index
 from recipes.models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingCartIngredient, Tag)
 from users.models import Follow, User
 
 
@@ -53,6 +59,8 @@ class UsersSerializer(UserSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -60,20 +68,30 @@ class UsersSerializer(UserSerializer):
         )
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций"""
+
+    ids = serializers.ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_LIMIT,
+    )
+
+
 class RecipeInfoSerializer(serializers.ModelSerializer):
     """Краткая информация о рецепте """
-    image = Base64ImageField()
+    image = RecipeImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class FollowSerializer(UsersSerializer):
     """Управление подписками"""
 
-    recipes_count = serializers.IntegerField(source='recipes.count',
-                                             read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = SerializerMethodField()
 
     class Meta(UsersSerializer.Meta):
@@ -98,11 +116,14 @@ class FollowSerializer(UsersSerializer):
         return data
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit:
+                recipes = recipes[:int(limit)]
         serializer = RecipeInfoSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
@@ -121,14 +142,65 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+RECIPE_PREFETCH = (
+    'tags',
+    Prefetch(
+        'ingredients_list',
+        queryset=IngredientForRecipe.objects.select_related(
+            'ingredient'
+        ).order_by('ingredient__name'),
+    ),
+)
+REQUEST_FIELDS = (
+    'author', 'is_favorited', 'is_in_shopping_cart', 'image', 'image_variants',
+)
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов с общим кэшем представлений"""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, models.Manager)
+                       else data)
+        cached = get_cached_recipes(recipes)
+        missing = [recipe for recipe in recipes if recipe.pk not in cached]
+        if missing:
+            prefetch_related_objects(missing, *RECIPE_PREFETCH)
+            rendered = {
+                recipe.pk: self.child.to_shared_representation(recipe)
+                for recipe in missing
+            }
+            set_cached_recipes(missing, rendered)
+            cached.update(rendered)
+        return [
+            self.child.add_user_flags(cached[recipe.pk], recipe)
+            for recipe in recipes
+        ]
+
+
+class ShoppingCartIngredientSerializer(serializers.ModelSerializer):
+    """Суммарное количество ингредиента в корзине"""
+
+    id = serializers.IntegerField(source='ingredient.id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = ShoppingCartIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Управление выводом рецептов"""
 
     tags = TagSerializer(many=True, read_only=True)
 
     ingredients = SerializerMethodField()
-    author = UsersSerializer(read_only=True)
-    image = Base64ImageField()
+    author = SerializerMethodField()
+    image = RecipeImageField()
+    image_variants = ImageVariantsField()
     is_in_shopping_cart = SerializerMethodField(read_only=True)
     is_favorited = SerializerMethodField(read_only=True)
 
@@ -137,19 +209,82 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'tags', 'author', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time',
+            'name', 'image', 'image_variants', 'text', 'cooking_time',
         )
+        list_serializer_class = RecipeListSerializer
 
-    def get_ingredients(self, obj):
-        ingredients = obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('ingredientforrecipe__amount')
+    def to_representation(self, instance):
+        data = get_cached_recipes([instance]).get(instance.pk)
+        if data is None:
+            prefetch_related_objects([instance], *RECIPE_PREFETCH)
+            data = self.to_shared_representation(instance)
+            set_cached_recipes([instance], {instance.pk: data})
+        return self.add_user_flags(data, instance)
+
+    def to_shared_representation(self, instance):
+        """
+        Представление рецепта без полей, зависящих от пользователя.
+        Ссылки на изображения хранятся относительными: адрес сервера
+        берётся из каждого запроса в add_user_flags.
+        """
+        data = super().to_representation(instance)
+        data.pop('is_favorited')
+        data.pop('is_in_shopping_cart')
+        data['author'].pop('is_subscribed')
+        data['image'] = instance.image.url if instance.image else None
+        data['image_variants'] = ImageVariantsField().to_representation(
+            instance.image_variants
+        )
+        return data
+
+    def add_user_flags(self, data, instance):
+        request = self.context.get('request')
+        flags = {
+            'author': {
+                **data['author'],
+                'is_subscribed': self.is_author_subscribed(instance),
+            },
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+            'image': absolute_uri(request, data['image']),
+            'image_variants': absolute_variant_urls(
+                request, data['image_variants']
+            ),
+        }
+        return {
+            field: flags[field] if field in REQUEST_FIELDS else data[field]
+            for field in self.Meta.fields
+        }
+
+    def is_author_subscribed(self, obj):
+        if hasattr(obj, 'author_subscribed'):
+            return obj.author_subscribed
+        user = self.context.get('request').user
+        return (
+            user.is_authenticated
+            and Follow.objects.filter(user=user, author=obj.author_id).exists()
         )
-        return ingredients
+
+    def get_ingredients(self, obj):
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.ingredients_list.all()
+        ]
+
+    def get_author(self, obj):
+        author = obj.author
+        # признак подписки подставляется в add_user_flags
+        author.is_subscribed = None
+        return dict(UsersSerializer(author, context=self.context).data)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -157,6 +292,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -164,6 +301,99 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
 
+INGREDIENTS_PREFETCH = Prefetch(
+    'ingredients_list',
+    queryset=IngredientForRecipe.objects.order_by('ingredient__name'),
+)
+
+
+class RecipeCardListSerializer(serializers.ListSerializer):
+    """Список карточек с загрузкой только запрошенных связей"""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, models.Manager)
+                       else data)
+        prefetch_related_objects(recipes, *self.child.get_prefetch())
+        return super().to_representation(recipes)
+
+
+class RecipeCardSerializer(RecipeInfoSerializer):
+    """
+    Карточка рецепта с полями из контекста 'fields'. Связи выводятся
+    идентификаторами, если не перечислены в контексте 'expand'.
+    """
+
+    tags = SerializerMethodField()
+    author = SerializerMethodField()
+    ingredients = SerializerMethodField()
+    is_favorited = SerializerMethodField()
+    is_in_shopping_cart = SerializerMethodField()
+
+    class Meta(RecipeInfoSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields
+        list_serializer_class = RecipeCardListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def is_expanded(self, name):
+        return name in self.context.get('expand', ())
+
+    def get_prefetch(self):
+        lookups = []
+        if 'tags' in self.fields:
+            lookups.append('tags')
+        if 'ingredients' in self.fields:
+            lookups.append(
+                RECIPE_PREFETCH[1] if self.is_expanded('ingredients')
+                else INGREDIENTS_PREFETCH
+            )
+        return lookups
+
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], *self.get_prefetch())
+        return super().to_representation(instance)
+
+    def get_tags(self, obj):
+        tags = obj.tags.all()
+        if self.is_expanded('tags'):
+            return TagSerializer(tags, many=True).data
+        return [tag.id for tag in tags]
+
+    def get_author(self, obj):
+        if not self.is_expanded('author'):
+            return obj.author_id
+        author = obj.author
+        author.is_subscribed = getattr(obj, 'author_subscribed', False)
+        return UsersSerializer(author, context=self.context).data
+
+    def get_ingredients(self, obj):
+        if not self.is_expanded('ingredients'):
+            return [
+                {'id': item.ingredient_id, 'amount': item.amount}
+                for item in obj.ingredients_list.all()
+            ]
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.ingredients_list.all()
+        ]
+
+    def get_is_favorited(self, obj):
+        return getattr(obj, 'is_favorited', False)
+
+    def get_is_in_shopping_cart(self, obj):
+        return getattr(obj, 'is_in_shopping_cart', False)
+
+
 class IngredientForRecipeNewSerializer(serializers.ModelSerializer):
     """Список ингредиентов для рецепта"""
 
@@ -177,7 +407,7 @@ class IngredientForRecipeNewSerializer(serializers.ModelSerializer):
 class NewRecipeSerializer(serializers.ModelSerializer):
     """Создание нового рецепта"""
 
-    image = Base64ImageField(use_url=True)
+    image = RecipeImageField(use_url=True)
     author = UsersSerializer(read_only=True)
     ingredients = IngredientForRecipeNewSerializer(many=True)
     tags = PrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
@@ -190,6 +420,25 @@ class NewRecipeSerializer(serializers.ModelSerializer):
             'name', 'text', 'cooking_time',
         )
 
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = self.parse_form(data)
+        return super().to_internal_value(data)
+
+    def parse_form(self, data):
+        """Поля multipart-формы, списки могут передаваться JSON-строкой"""
+        parsed = {key: data.get(key) for key in data}
+        for name in ('ingredients', 'tags'):
+            values = data.getlist(name)
+            if len(values) == 1 and values[0].lstrip().startswith('['):
+                try:
+                    parsed[name] = json.loads(values[0])
+                except ValueError:
+                    raise ValidationError({name: ['Некорректный JSON.']})
+            elif values:
+                parsed[name] = values
+        return parsed
+
     def validate_ingredients(self, value):
         """Валидатор ингредиентов в рецепте."""
 
@@ -201,20 +450,26 @@ class NewRecipeSerializer(serializers.ModelSerializer):
                 raise ValidationError({
                     'Количество ингредиентов должно быть больше 0!'
                 })
-        items = [item["id"] for item in ingredients]
-        if len(items) != len(set(items)):
+        ids = {item['id'] for item in ingredients}
+        if len(ids) != len(ingredients):
             raise ValidationError({'Ингредиенты должны быть уникальными!'})
+        unknown = ids - set(
+            Ingredient.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        if unknown:
+            raise ValidationError(
+                'Ингредиенты не найдены: {}'.format(
+                    ', '.join(map(str, sorted(unknown)))
+                )
+            )
         return value
 
     def validate_tags(self, value):
         tags = value
         if not tags:
             raise ValidationError({'Выберите теги!'})
-        tags_list = []
-        for tag in tags:
-            if tag in tags_list:
-                raise ValidationError({'Теги не должны повторяться!'})
-            tags_list.append(tag)
+        if len(set(tags)) != len(tags):
+            raise ValidationError({'Теги не должны повторяться!'})
         return value
 
     @transaction.atomic
@@ -236,13 +491,74 @@ class NewRecipeSerializer(serializers.ModelSerializer):
         recipe = super().create(validated_data)
         self.create_ingredients(recipe, ingredients)
         recipe.tags.set(tags)
+        recipe_ingredient_index.refresh([recipe.pk])
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Изменение ингредиентов рецепта по разнице с текущими записями"""
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        current = {
+            item.ingredient_id: item
+            for item in IngredientForRecipe.objects.filter(recipe=recipe)
+        }
+        deltas = {}
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id, 0)
+            if amount != item.amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        created = [
+            IngredientForRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        deltas.update((item.ingredient_id, item.amount) for item in created)
+        removed = [item.ingredient_id for item in changed if not item.amount]
+        if removed:
+            IngredientForRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        IngredientForRecipe.objects.bulk_update(
+            [item for item in changed if item.amount], ('amount',)
+        )
+        IngredientForRecipe.objects.bulk_create(created)
+        ShoppingCartIngredient.objects.change_recipe(recipe, deltas)
+        if created or removed:
+            recipe_ingredient_index.refresh([recipe.pk])
+        return bool(deltas)
+
+    def is_same_image(self, instance, image):
+        field = instance.image.field
+        name = field.generate_filename(instance, image.name)
+        return field.storage.get_content_name(name, image) == (
+            instance.image.name
+        )
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        IngredientForRecipe.objects.filter(recipe=instance).delete()
-        self.create_ingredients(instance, ingredients)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if 'image' in validated_data and self.is_same_image(
+            instance, validated_data['image']
+        ):
+            del validated_data['image']
+        changed = any(
+            getattr(instance, field) != value
+            for field, value in validated_data.items()
+        )
+        if ingredients is not None:
+            changed = self.update_ingredients(instance, ingredients) or changed
+        if tags is not None and set(
+            instance.tags.values_list('pk', flat=True)
+        ) != {tag.pk for tag in tags}:
+            instance.tags.set(tags)
+            changed = True
+        if not changed:
+            return instance
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+import os
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+# стандартные шрифты PDF не содержат кириллицы
+PDF_FONT = 'DejaVuSans'
+PDF_FONT_PATH = os.path.join(
+    os.path.dirname(__file__), 'fonts', 'DejaVuSans.ttf'
+)
+
+
+def export_txt(user, date, ingredients):
+    yield (
+        f'Список покупок для: {user.get_full_name()}\n\n'
+        f'Дата: {date:%Y-%m-%d}\n\n'
+    )
+    separator = ''
+    for ingredient in ingredients:
+        yield (
+            f'{separator}- {ingredient["ingredient__name"]} '
+            f'({ingredient["ingredient__measurement_unit"]})'
+            f' - {ingredient["quantity"]}'
+        )
+        separator = '\n'
+
+
+def export_csv(user, date, ingredients):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(('name', 'measurement_unit', 'amount'))
+    for ingredient in ingredients:
+        writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['quantity'],
+        ))
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+
+def export_json(user, date, ingredients):
+    yield (
+        f'{{"user": {json.dumps(user.get_full_name(), ensure_ascii=False)}, '
+        f'"date": "{date:%Y-%m-%d}", "ingredients": ['
+    )
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['quantity'],
+        }, ensure_ascii=False)
+        separator = ', '
+    yield ']}'
+
+
+def export_pdf(user, date, ingredients):
+    """PDF строится в памяти: список покупок ограничен числом ингредиентов"""
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(PDF_FONT, PDF_FONT_PATH))
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle('Список покупок')
+    width, height = A4
+    top, bottom, left = height - 20 * mm, 20 * mm, 20 * mm
+    pdf.setFont(PDF_FONT, 14)
+    pdf.drawString(left, top, f'Список покупок для: {user.get_full_name()}')
+    pdf.setFont(PDF_FONT, 10)
+    pdf.drawString(left, top - 8 * mm, f'Дата: {date:%Y-%m-%d}')
+    y = top - 20 * mm
+    for ingredient in ingredients:
+        if y < bottom:
+            pdf.showPage()
+            pdf.setFont(PDF_FONT, 10)
+            y = top
+        pdf.drawString(
+            left, y,
+            f'- {ingredient["ingredient__name"]} '
+            f'({ingredient["ingredient__measurement_unit"]})'
+            f' - {ingredient["quantity"]}'
+        )
+        y -= 6 * mm
+    pdf.save()
+    yield buffer.getvalue()
+
+
+SHOPPING_LIST_EXPORTS = {
+    'txt': export_txt,
+    'csv': export_csv,
+    'json': export_json,
+    'pdf': export_pdf,
+}
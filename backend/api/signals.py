@@ -0,0 +1,162 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from api.cache import invalidate_all_recipes, invalidate_feeds, invalidate_tags
+from api.catalogue import ingredient_catalogue, tag_catalogue
+from api.images import release_images, schedule_variants
+from api.search import ingredient_index, recipe_ingredient_index
+from recipes.models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
+                            ShoppingCart, ShoppingCartIngredient, Tag,
+                            change_counter)
+from users.models import Follow, User
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+_carts = threading.local()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        invalidate_feeds(
+            Follow.objects.filter(
+                author=instance.author_id
+            ).values_list('user_id', flat=True)
+        )
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_image_replaced(sender, instance, raw, **kwargs):
+    if raw or instance.pk is None:
+        return
+    old_image = Recipe.objects.filter(pk=instance.pk).values_list(
+        'image', flat=True
+    ).first()
+    if old_image and old_image != instance.image.name:
+        transaction.on_commit(lambda: release_images([old_image]))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, raw, created, **kwargs):
+    if raw:
+        return
+    schedule_variants(instance)
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_count_deleted(sender, instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count', -1
+    )
+    recipe_ingredient_index.refresh([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def user_lists_deleted(sender, instance, **kwargs):
+    for model, field in (
+        (Favorites, 'favorites_count'), (ShoppingCart, 'in_carts_count')
+    ):
+        change_counter(
+            Recipe.objects.filter(
+                pk__in=model.objects.filter(user=instance).values('recipe_id')
+            ),
+            field,
+            -1,
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: release_images([instance.image.name]))
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    invalidate_feeds([instance.user_id])
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    ShoppingCartIngredient.objects.change_recipe(instance, {
+        ingredient_id: -amount
+        for ingredient_id, amount in instance.ingredients_list.values_list(
+            'ingredient_id', 'amount'
+        )
+    })
+
+
+@contextmanager
+def counted_cart_changes():
+    """Изменения корзин внутри блока уже учтены в суммах вызывающим кодом"""
+    _carts.counted = True
+    try:
+        yield
+    finally:
+        _carts.counted = False
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    """
+    Пересчёт сумм корзины после фиксации транзакции: так учитываются
+    loaddata (raw), админка и каскадные удаления. Изменения через API
+    учитываются во вьюсете по рецептам.
+    """
+    if getattr(_carts, 'counted', False):
+        return
+    user_id = instance.user_id
+    transaction.on_commit(
+        lambda: ShoppingCartIngredient.objects.rebuild([user_id])
+    )
+
+
+@receiver((post_save, post_delete), sender=IngredientForRecipe)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).touch()
+    if not kwargs.get('raw'):
+        recipe_ingredient_index.refresh([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).touch()
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).touch()
+    else:
+        invalidate_all_recipes()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def catalogue_changed(sender, **kwargs):
+    invalidate_all_recipes()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    invalidate_tags()
+    tag_catalogue.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    ingredient_index.invalidate()
+    ingredient_catalogue.invalidate()
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields and not AUTHOR_FIELDS & set(update_fields):
+        return
+    instance.recipes.touch()
@@ -0,0 +1,77 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+RECIPES_COUNT = 8
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader', email='r@ya.ru')
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        for number in range(RECIPES_COUNT):
+            author = User.objects.create(
+                username=f'author{number}', email=f'a{number}@ya.ru'
+            )
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image=f'recipes/{number}.jpg',
+            )
+            recipe.tags.set(tags)
+            IngredientForRecipe.objects.bulk_create(
+                IngredientForRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients
+            )
+            if number % 2:
+                Favorites.objects.create(user=cls.user, recipe=recipe)
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+                Follow.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, client, limit):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def assert_queries_independent_of_limit(self, client):
+        expected = self.count_queries(client, 1)
+        cache.clear()
+        with self.assertNumQueries(expected):
+            response = client.get('/api/recipes/', {'limit': RECIPES_COUNT})
+        self.assertEqual(len(response.data['results']), RECIPES_COUNT)
+
+    def test_anonymous(self):
+        self.assert_queries_independent_of_limit(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_queries_independent_of_limit(client)
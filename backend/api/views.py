@@ -1,21 +1,62 @@
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+import hashlib
+from itertools import chain
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, When
+from django.http import Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import cached_property
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from api.filters import IngredientsSearchFilter, RecipeAndTagsFilter
-from api.pagination import SetCustomPagination
+from api.cache import (get_cached_feed_head, get_recipe_generation,
+                       set_cached_feed_head)
+from api.catalogue import ingredient_catalogue, tag_catalogue
+from api.filters import (IngredientsSearchFilter, RecipeAndTagsFilter,
+                         RecipeOrderingFilter)
+from api.pagination import (RecipeCursorPagination, RecipePagination,
+                            SetCustomPagination)
 from api.permissions import IsAdminOrReadOnly, IsAuthorAdminOrReadOnly
+from api.renderers import SHOPPING_LIST_RENDERERS
+from api.search import ingredient_index, recipe_ingredient_index
 from api.serializers import (IngredientSerializer, NewRecipeSerializer,
+                             RecipeCardSerializer, RecipeIdsSerializer,
                              RecipeInfoSerializer, RecipeSerializer,
-                             TagSerializer)
-from recipes.models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
-                            ShoppingCart, Tag)
+                             ShoppingCartIngredientSerializer, TagSerializer)
+from api.shopping_list import SHOPPING_LIST_EXPORTS
+from api.signals import counted_cart_changes
+from recipes.models import (Favorites, Ingredient, Recipe, ShoppingCart,
+                            ShoppingCartIngredient, Tag, change_counter)
+from users.models import Follow, User
+
+SHOPPING_LIST_CHUNK_SIZE = 500
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart', 'author_subscribed')
+CARD_FIELDS = (
+    'id', 'name', 'image', 'image_variants', 'cooking_time', 'tags',
+)
+EXPANDABLE_FIELDS = ('tags', 'author', 'ingredients')
+RECIPE_COLUMNS = ('name', 'image', 'image_variants', 'text', 'cooking_time')
+COUNTER_FIELDS = {
+    Favorites: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+BATCH_STATUSES = {
+    'POST': ('added', 'exists'),
+    'DELETE': ('removed', 'absent'),
+}
+
+
+def split_param(value):
+    return [item for item in value.split(',') if item] if value else []
 
 
 class IngredientViewSet(viewsets.ModelViewSet):
@@ -27,6 +68,24 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientsSearchFilter
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        search = request.query_params.get('search')
+        if not name and not search:
+            return ingredient_catalogue.response(request)
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.INGREDIENT_SEARCH_LIMIT
+            ))
+        except ValueError:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        limit = max(limit, 0)
+        if search:
+            queryset = self.filter_queryset(self.get_queryset())[:limit]
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data)
+        return Response(ingredient_index.search_prefix(name, limit))
+
 
 class TagViewSet(viewsets.ModelViewSet):
     """Теги"""
@@ -35,6 +94,9 @@ class TagViewSet(viewsets.ModelViewSet):
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly,)
 
+    def list(self, request, *args, **kwargs):
+        return tag_catalogue.response(request)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """Работа со списком рецептов, добавление,
@@ -45,15 +107,196 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (
         IsAuthorAdminOrReadOnly | IsAdminOrReadOnly,
     )
-    pagination_class = SetCustomPagination
-    filter_backends = (DjangoFilterBackend,)
+    pagination_class = RecipePagination
+    parser_classes = (JSONParser, MultiPartParser)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeAndTagsFilter
+    ordering_fields = ('pub_date', 'favorites_count', 'in_carts_count')
+    ordering = ('-pub_date', '-id')
 
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
+            if self.sparse_fields is not None:
+                return RecipeCardSerializer
             return RecipeSerializer
         return NewRecipeSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.sparse_fields is not None:
+            context['fields'], context['expand'] = self.sparse_fields
+        return context
+
+    @cached_property
+    def sparse_fields(self):
+        """Поля из ?fields= и раскрываемые связи из ?expand="""
+        params = self.request.query_params
+        if (
+            self.request.method not in permissions.SAFE_METHODS
+            or 'fields' not in params and 'expand' not in params
+        ):
+            return None
+        fields = split_param(params.get('fields')) or list(CARD_FIELDS)
+        expand = split_param(params.get('expand'))
+        errors = {}
+        unknown = set(fields) - set(RecipeSerializer.Meta.fields)
+        if unknown:
+            errors['fields'] = [f'Неизвестные поля: {", ".join(unknown)}']
+        unknown = set(expand) - set(EXPANDABLE_FIELDS)
+        if unknown:
+            errors['expand'] = [f'Неизвестные связи: {", ".join(unknown)}']
+        if errors:
+            raise ValidationError(errors)
+        return fields, expand
+
+    def get_queryset(self):
+        user = self.request.user
+        if self.sparse_fields is None:
+            return Recipe.objects.select_related('author').with_user_flags(
+                user
+            )
+        fields, expand = self.sparse_fields
+        queryset = Recipe.objects.only(
+            'author', 'pub_date', 'updated_at',
+            *(field for field in RECIPE_COLUMNS if field in fields),
+        )
+        flags = [
+            flag for flag in ('is_favorited', 'is_in_shopping_cart')
+            if flag in fields
+        ]
+        if 'author' in fields and 'author' in expand:
+            queryset = queryset.select_related('author')
+            flags.append('author_subscribed')
+        return queryset.with_user_flags(user, flags)
+
+    def get_etag(self, recipes, *state):
+        """ETag по версиям рецептов и признакам текущего пользователя"""
+        state = [get_recipe_generation(), *state]
+        for recipe in recipes:
+            state.append((
+                recipe.pk,
+                recipe.updated_at.isoformat(),
+                *(getattr(recipe, flag, None) for flag in USER_FLAGS),
+            ))
+        return 'W/"%s"' % hashlib.sha1(repr(state).encode()).hexdigest()
+
+    def conditional_response(self, request, etag, get_response):
+        """304 без сериализации, если у клиента актуальная версия"""
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = get_response()
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        envelope = self.get_paginated_response(None).data
+        return self.conditional_response(
+            request,
+            self.get_etag(page, *envelope.items()),
+            lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True).data
+            ),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.conditional_response(
+            request,
+            self.get_etag([instance]),
+            lambda: Response(self.get_serializer(instance).data),
+        )
+
+    def get_feed_queryset(self, user):
+        return self.get_queryset().filter(
+            author__in=Follow.objects.filter(user=user).values('author')
+        )
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь"""
+        user = request.user
+        queryset = self.get_feed_queryset(user)
+        paginator = RecipeCursorPagination()
+        limit = paginator.get_page_size(request)
+        if {paginator.cursor_query_param, 'ordering'} & set(
+            request.query_params
+        ):
+            page = paginator.paginate_queryset(queryset, request, self)
+            serializer = self.get_serializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        head = get_cached_feed_head(user.id, limit)
+        if head is None:
+            page = paginator.paginate_queryset(queryset, request, self)
+            next_link = paginator.get_next_link()
+            # в кэше только курсор: ссылка строится из текущего запроса
+            head = {
+                'ids': [recipe.pk for recipe in page],
+                'cursor': next_link and parse_qs(urlparse(next_link).query)[
+                    paginator.cursor_query_param
+                ][0],
+            }
+            set_cached_feed_head(user.id, limit, head)
+        else:
+            page = queryset.filter(pk__in=head['ids']).order_by(Case(
+                *[When(pk=pk, then=position)
+                  for position, pk in enumerate(head['ids'])],
+                output_field=IntegerField(),
+            ))
+        serializer = self.get_serializer(page, many=True)
+        return Response({
+            'next': head['cursor'] and replace_query_param(
+                request.build_absolute_uri(),
+                paginator.cursor_query_param,
+                head['cursor'],
+            ),
+            'previous': None,
+            'results': serializer.data,
+        })
+
+    def get_ingredient_ids(self, request):
+        values = chain.from_iterable(
+            map(split_param, request.query_params.getlist('ingredients'))
+        )
+        try:
+            ingredient_ids = {int(value) for value in values}
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': ['Id ингредиентов должны быть числами.']}
+            )
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': ['Укажите ингредиенты.']})
+        if len(ingredient_ids) > settings.COOK_INGREDIENTS_LIMIT:
+            raise ValidationError({'ingredients': [
+                'Не более {} ингредиентов.'.format(
+                    settings.COOK_INGREDIENTS_LIMIT
+                )
+            ]})
+        return ingredient_ids
+
+    @action(detail=False)
+    def by_ingredients(self, request):
+        """
+        Рецепты по доле ингредиентов из ?ingredients=, которые есть
+        у пользователя: сначала те, для которых есть всё необходимое
+        """
+        ranked = recipe_ingredient_index.rank(
+            self.get_ingredient_ids(request)
+        )
+        paginator = SetCustomPagination()
+        page = paginator.paginate_queryset(ranked, request, self)
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True
+        )
+        return paginator.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -64,23 +307,105 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.add_recipe(Favorites, request.user, pk)
         return self.delete_recipe(Favorites, request.user, pk)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated]
+    )
+    def batch_favorite(self, request):
+        return self.batch_response(Favorites, request)
+
+    def get_listed_recipes(self, model, user, ids):
+        """Рецепты по id с признаком наличия в списке пользователя"""
+        # блокировка сериализует изменения списков одного пользователя
+        User.objects.select_for_update().get(pk=user.pk)
+        recipes = Recipe.objects.filter(pk__in=ids).only(
+            'name', 'image', 'image_variants', 'cooking_time'
+        ).annotate(in_list=Exists(
+            model.objects.filter(user=user, recipe=OuterRef('pk'))
+        ))
+        return {recipe.pk: recipe for recipe in recipes}
+
+    @transaction.atomic
+    def add_recipes(self, model, user, ids):
+        recipes = self.get_listed_recipes(model, user, ids)
+        added = [pk for pk, recipe in recipes.items() if not recipe.in_list]
+        model.objects.bulk_create(
+            [model(user=user, recipe_id=pk) for pk in added],
+            ignore_conflicts=True,
+        )
+        change_counter(
+            Recipe.objects.filter(pk__in=added), COUNTER_FIELDS[model], 1
+        )
+        if model is ShoppingCart:
+            ShoppingCartIngredient.objects.add_recipes(user, added)
+        return recipes, added
+
+    @transaction.atomic
+    def remove_recipes(self, model, user, ids):
+        recipes = self.get_listed_recipes(model, user, ids)
+        removed = [pk for pk, recipe in recipes.items() if recipe.in_list]
+        if removed:
+            with counted_cart_changes():
+                model.objects.filter(
+                    user=user, recipe_id__in=removed
+                ).delete()
+            change_counter(
+                Recipe.objects.filter(pk__in=removed),
+                COUNTER_FIELDS[model],
+                -1,
+            )
+            if model is ShoppingCart:
+                ShoppingCartIngredient.objects.remove_recipes(user, removed)
+        return recipes, removed
+
     def add_recipe(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        pk = self.parse_pk(pk)
+        recipes, added = self.add_recipes(model, user, [pk])
+        if pk not in recipes:
+            raise Http404
+        if not added:
             return Response({'Рецепт уже был добавлен ранее!'},
                             status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
-        serializer = RecipeInfoSerializer(recipe)
+        serializer = RecipeInfoSerializer(recipes[pk])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_recipe(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        _, removed = self.remove_recipes(model, user, [self.parse_pk(pk)])
+        if removed:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'errors': 'Рецепт уже удален!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    def parse_pk(self, pk):
+        try:
+            return int(pk)
+        except ValueError:
+            raise Http404
+
+    def batch_response(self, model, request):
+        """Пакетное добавление или удаление рецептов со статусом по id"""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        if request.method == 'POST':
+            recipes, changed = self.add_recipes(model, request.user, ids)
+        else:
+            recipes, changed = self.remove_recipes(model, request.user, ids)
+        changed = set(changed)
+        changed_status, unchanged_status = BATCH_STATUSES[request.method]
+        return Response([
+            {
+                'id': pk,
+                'status': (
+                    'not_found' if pk not in recipes
+                    else changed_status if pk in changed
+                    else unchanged_status
+                ),
+            }
+            for pk in ids
+        ])
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -93,34 +418,52 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(
         detail=False,
+        methods=['post', 'delete'],
         permission_classes=[IsAuthenticated]
     )
+    def batch_shopping_cart(self, request):
+        return self.batch_response(ShoppingCart, request)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_preview(self, request):
+        ingredients = request.user.shopping_cart_ingredients.select_related(
+            'ingredient'
+        ).order_by('ingredient__name')
+        serializer = ShoppingCartIngredientSerializer(ingredients, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+    )
     def download_shopping_cart(self, request):
         user = request.user
-        if not user.shopping_cart.exists():
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-
-        ingredients = IngredientForRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
+        ingredients = user.shopping_cart_ingredients.values(
             'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(quantity=Sum('amount'))
-
-        today = timezone.now().date()
-        shopping_list = (
-            f'Список покупок для: {user.get_full_name()}\n\n'
-            f'Дата: {today:%Y-%m-%d}\n\n'
+            'ingredient__measurement_unit',
+            quantity=F('amount'),
+        ).order_by('ingredient__name').iterator(
+            chunk_size=SHOPPING_LIST_CHUNK_SIZE
         )
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["quantity"]}'
-            for ingredient in ingredients
-        ])
+        first = next(ingredients, None)
+        if first is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        filename = f'{user.username}_shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        export_format = request.accepted_renderer.format
+        export = SHOPPING_LIST_EXPORTS[export_format]
+        response = StreamingHttpResponse(
+            export(user, timezone.now().date(), chain([first], ingredients)),
+            content_type=(
+                f'{request.accepted_renderer.media_type}; charset=utf-8'
+                if request.accepted_renderer.charset
+                else request.accepted_renderer.media_type
+            ),
+        )
+        filename = f'{user.username}_shopping_list.{export_format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
 
         return response
@@ -18,6 +18,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -88,6 +89,28 @@ else:
         }
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+# без общего кэша (LocMemCache в каждом процессе) версии каталогов
+# и индексов истекают, и процессы перечитывают данные из БД
+CACHE_VERSION_TIMEOUT = (
+    60 if CACHES['default']['BACKEND'].endswith('.LocMemCache') else None
+)
+RECIPE_INDEX_LOG_TIMEOUT = 24 * 60 * 60
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', default=300))
+FEED_CACHE_TIMEOUT = 300
+PAGINATION_COUNT_CACHE_TIMEOUT = 15
+PAGINATION_ESTIMATE_THRESHOLD = 100000
+INGREDIENT_SEARCH_LIMIT = 50
+RECIPE_BATCH_LIMIT = 100
+COOK_INGREDIENTS_LIMIT = 50
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': ('django.contrib.auth.password_validation.'
@@ -123,6 +146,20 @@ if DEBUG:
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+MAX_IMAGE_PIXELS = 40_000_000
+IMAGE_VARIANT_SIZES = {
+    'thumbnail': (400, 400),
+    'detail': (1200, 1200),
+}
+IMAGE_VARIANT_FORMATS = ('avif', 'webp')
+IMAGE_VARIANT_QUALITY = {'avif': 60, 'webp': 80}
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+IMAGE_GC_GRACE = 600
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.User'
 
@@ -1,21 +1,19 @@
 from django.contrib import admin
-from django.contrib.admin import display
 
 from .models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingCartIngredient, Tag)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'quantity_in_favorites')
-    readonly_fields = ('quantity_in_favorites',)
+    list_display = (
+        'id', 'name', 'author', 'favorites_count', 'in_carts_count',
+    )
+    readonly_fields = ('favorites_count', 'in_carts_count')
     list_filter = ('author', 'name', 'tags',)
+    list_select_related = ('author',)
     empty_value_display = '-пусто-'
 
-    @display(description='Добавлено в избранное')
-    def quantity_in_favorites(self, obj):
-        return obj.favorites.count()
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -36,6 +34,12 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+@admin.register(ShoppingCartIngredient)
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount',)
+    empty_value_display = '-пусто-'
+
+
 @admin.register(Favorites)
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe',)
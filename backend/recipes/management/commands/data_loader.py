@@ -1,39 +1,193 @@
 import csv
+import io
+import json
 import os.path
-import sys
 import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
+from api.cache import invalidate_all_recipes
+from api.catalogue import ingredient_catalogue
+from api.search import ingredient_index
 from recipes.models import Ingredient
 
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file, delimiter=','):
+        if len(row) < 2:
+            raise CommandError(f'Некорректная строка: {row}')
+        yield row[0], row[1]
+
+
+def read_json(file):
+    """Чтение объектов JSON-массива по частям, без загрузки файла целиком"""
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив ингредиентов.')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip(', \t\r\n')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Некорректный JSON-файл.')
+            buffer += chunk
+            continue
+        yield item['name'], item['measurement_unit']
+        buffer = buffer[end:]
+
+
+class CopyStream:
+    """Файлоподобный объект для COPY ... FROM STDIN из итератора строк"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = io.StringIO()
+            csv.writer(line).writerow(row)
+            self.buffer += line.getvalue()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
 
 class Command(BaseCommand):
     """
-    Команда 'data_loader' загружает данные
-    в БД из csv файла. Статичная директория «./data/».
+    Команда 'data_loader' загружает ингредиенты в БД из csv или json
+    файла (по умолчанию «./data/ingredients.csv»). Идентификатор
+    ингредиента - номер строки файла, повторный запуск обновляет записи.
     """
 
     help = 'load data from csv files'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=os.path.join('./data/', 'ingredients.csv')
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
     def handle(self, *args, **options):
-        count = 0
-        file = 'ingredients.csv'
-        path = (os.path.join('./data/', file))
-        with open(path, 'r', encoding='utf-8') as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            for row in csv_reader:
-                id = count
-                ingredients = Ingredient(
-                    id=id,
-                    name=row[0],
-                    measurement_unit=row[1]
+        path = options['path']
+        reader = read_json if path.endswith('.json') else read_csv
+        started = time.monotonic()
+        with open(path, 'r', encoding='utf-8') as file:
+            rows = (
+                (id, name, measurement_unit)
+                for id, (name, measurement_unit) in enumerate(reader(file))
+            )
+            upsert = (
+                self.copy if connection.vendor == 'postgresql'
+                else self.bulk_upsert
+            )
+            with transaction.atomic():
+                total, written = upsert(rows, options['batch_size'])
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+                elif written:
+                    # названия ингредиентов входят в кэш рецептов
+                    ingredient_catalogue.invalidate()
+                    ingredient_index.invalidate()
+                    invalidate_all_recipes()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Обработано записей: {total}, изменено: {written}'
+            + (' (пробный запуск, изменения отменены)'
+               if options['dry_run'] else '')
+        )
+        self.stdout.write(
+            f'Загрузка завершена за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else total:.0f} записей/с).'
+        )
+
+    def bulk_upsert(self, rows, batch_size):
+        total = written = 0
+        while True:
+            batch = {
+                id: (name, measurement_unit)
+                for id, name, measurement_unit in islice(rows, batch_size)
+            }
+            if not batch:
+                return total, written
+            existing = Ingredient.objects.in_bulk(list(batch))
+            changed = []
+            for ingredient in existing.values():
+                name, measurement_unit = batch[ingredient.id]
+                if (ingredient.name, ingredient.measurement_unit) != (
+                    name, measurement_unit
+                ):
+                    ingredient.name = name
+                    ingredient.measurement_unit = measurement_unit
+                    changed.append(ingredient)
+            Ingredient.objects.bulk_update(
+                changed, ('name', 'measurement_unit')
+            )
+            new_ids = [id for id in batch if id not in existing]
+            # при конфликте строка не вставляется: считаем записи в БД
+            new = Ingredient.objects.filter(id__in=new_ids)
+            before = new.count()
+            Ingredient.objects.bulk_create(
+                [
+                    Ingredient(id=id, name=name, measurement_unit=unit)
+                    for id, (name, unit) in batch.items()
+                    if id in new_ids
+                ],
+                ignore_conflicts=True,
+            )
+            total += len(batch)
+            written += len(changed) + new.count() - before
+
+    def copy(self, rows, batch_size):
+        table = Ingredient._meta.db_table
+        total = written = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(id bigint, name varchar(200), measurement_unit varchar(10))'
+                ' ON COMMIT DROP'
+            )
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                cursor.execute('TRUNCATE ingredient_import')
+                cursor.cursor.copy_expert(
+                    'COPY ingredient_import (id, name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    CopyStream(iter(batch)),
+                )
+                cursor.execute(
+                    f'INSERT INTO {table} (id, name, measurement_unit) '
+                    'SELECT id, name, measurement_unit '
+                    'FROM ingredient_import '
+                    'ON CONFLICT (id) DO UPDATE SET '
+                    'name = EXCLUDED.name, '
+                    'measurement_unit = EXCLUDED.measurement_unit '
+                    f'WHERE ({table}.name, {table}.measurement_unit) '
+                    'IS DISTINCT FROM '
+                    '(EXCLUDED.name, EXCLUDED.measurement_unit)'
                 )
-                ingredients.save()
-                count += 1
-                print('\b' * 30, end='')
-                print('Добавлено записей: {}'.format(count), end='')
-                sys.stdout.flush()
-                time.sleep(0.05)
-        print('\n')
-        print('Загрузка завершена.')
+                total += len(batch)
+                written += cursor.rowcount
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [Ingredient]
+            ):
+                cursor.execute(sql)
+        return total, written
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingCartIngredient, User
+
+
+class Command(BaseCommand):
+    """
+    Команда 'rebuild_shopping_cart' пересчитывает суммы ингредиентов
+    в корзинах всех (или указанных) пользователей.
+    """
+
+    help = 'rebuild shopping cart ingredient totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='+')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['user']:
+            users = User.objects.filter(pk__in=options['user'])
+        ShoppingCartIngredient.objects.rebuild(users)
+        self.stdout.write(
+            'Записей в корзинах: {}'.format(
+                ShoppingCartIngredient.objects.count()
+            )
+        )
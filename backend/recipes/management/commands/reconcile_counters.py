@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorites, Recipe, ShoppingCart, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorites, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+)
+
+
+def count_of(model, field):
+    """Фактическое число связанных записей для OuterRef('pk')"""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    """
+    Команда 'reconcile_counters' сверяет денормализованные счётчики
+    (избранное и корзины рецептов, рецепты пользователей) с фактическими
+    данными и исправляет расхождения. Рассчитана на периодический запуск.
+    """
+
+    help = 'repair drift of denormalized counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, counter, source, field in COUNTERS:
+            drifted = list(
+                model.objects.order_by().annotate(
+                    actual=count_of(source, field)
+                ).exclude(**{counter: F('actual')}).values_list(
+                    'pk', flat=True
+                )
+            )
+            for start in range(0, len(drifted), batch_size):
+                # пересчёт в самом UPDATE не теряет параллельных изменений
+                model.objects.filter(
+                    pk__in=drifted[start:start + batch_size]
+                ).update(**{counter: count_of(source, field)})
+            self.stdout.write(
+                f'{model._meta.label}.{counter}: исправлено {len(drifted)}'
+            )
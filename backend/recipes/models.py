@@ -1,10 +1,21 @@
 from django.contrib.auth import get_user_model
 from django.core import validators
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from recipes.storage import recipe_image_storage
+from users.models import Follow
 
 User = get_user_model()
 
 
+def change_counter(queryset, field, delta):
+    """Атомарное изменение счётчика у записей, без ухода в минус"""
+    return queryset.update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
 class Ingredient(models.Model):
     name = models.CharField('Название', max_length=200)
     measurement_unit = models.CharField('Единица измерения', max_length=10)
@@ -42,6 +53,34 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user, flags=None):
+        """Признаки избранного, корзины и подписки для пользователя"""
+        if not user.is_authenticated:
+            return self
+        annotations = {
+            'is_favorited': Exists(Favorites.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            'is_in_shopping_cart': Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            'author_subscribed': Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author')
+            )),
+        }
+        if flags is not None:
+            annotations = {
+                flag: annotations[flag] for flag in flags
+            }
+        return self.annotate(**annotations)
+
+    def touch(self):
+        """Обновление даты изменения без сохранения объектов"""
+        return self.update(updated_at=timezone.now())
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -52,7 +91,14 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         'Изображение',
-        upload_to='recipes/'
+        upload_to='recipes/',
+        storage=recipe_image_storage,
+    )
+    image_variants = models.JSONField(
+        'Варианты изображения',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     name = models.CharField('Название', max_length=250)
     text = models.TextField('Описание')
@@ -75,9 +121,38 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True)
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True)
+    favorites_count = models.PositiveIntegerField(
+        'Добавлено в избранное',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'Добавлено в корзины',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popularity_idx'
+            ),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -172,3 +247,135 @@ class Favorites(models.Model):
 
     def __str__(self):
         return f'"{self.recipe}" добавлено в избранное'
+
+
+class ShoppingCartIngredientManager(models.Manager):
+
+    @transaction.atomic
+    def add_amounts(self, deltas):
+        """Изменение сумм по словарю {(user_id, ingredient_id): delta}"""
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        existing = {
+            (row.user_id, row.ingredient_id): row
+            for row in self.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in deltas},
+                ingredient_id__in={ingredient for _, ingredient in deltas},
+            )
+        }
+        created, changed, deleted = [], [], []
+        for (user_id, ingredient_id), delta in deltas.items():
+            row = existing.get((user_id, ingredient_id))
+            if row is None:
+                if delta > 0:
+                    created.append(self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=delta,
+                    ))
+            elif row.amount + delta > 0:
+                row.amount += delta
+                changed.append(row)
+            else:
+                deleted.append(row.pk)
+        self.bulk_create(created)
+        self.bulk_update(changed, ('amount',))
+        self.filter(pk__in=deleted).delete()
+
+    def add_recipes(self, user, recipe_ids, sign=1):
+        """Учёт рецептов, добавленных в корзину (sign=-1 - удалённых)"""
+        amounts = IngredientForRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(total=Sum('amount'))
+        self.add_amounts({
+            (user.id, row['ingredient_id']): sign * row['total']
+            for row in amounts
+        })
+
+    def remove_recipes(self, user, recipe_ids):
+        self.add_recipes(user, recipe_ids, sign=-1)
+
+    def change_recipe(self, recipe, ingredient_deltas):
+        """Учёт изменения ингредиентов рецепта во всех корзинах с ним"""
+        ingredient_deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in ingredient_deltas.items() if delta
+        }
+        if not ingredient_deltas:
+            return
+        user_ids = ShoppingCart.objects.filter(
+            recipe=recipe
+        ).values_list('user_id', flat=True)
+        self.add_amounts({
+            (user_id, ingredient_id): delta
+            for user_id in user_ids
+            for ingredient_id, delta in ingredient_deltas.items()
+        })
+
+    @transaction.atomic
+    def rebuild(self, users=None):
+        """Пересчёт сумм с нуля по корзинам пользователей (или всех)"""
+        # та же блокировка, что у изменений корзины через API
+        locked = User.objects.select_for_update().order_by('pk')
+        if users is not None:
+            locked = locked.filter(pk__in=users)
+        list(locked.values_list('pk', flat=True))
+        carts = IngredientForRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False
+        )
+        rows = self.all()
+        if users is not None:
+            carts = IngredientForRecipe.objects.filter(
+                recipe__shopping_cart__user__in=users
+            )
+            rows = rows.filter(user__in=users)
+        rows.delete()
+        totals = carts.values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by()
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=row['recipe__shopping_cart__user'],
+                    ingredient_id=row['ingredient'],
+                    amount=row['total'],
+                )
+                for row in totals.iterator()
+            ],
+            batch_size=1000,
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в корзине пользователя"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в корзине'
+        verbose_name_plural = 'Ингредиенты в корзине'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='shopping_cart_ingredient_uniq')
+        ]
+
+    def __str__(self):
+        return (
+            f'{self.ingredient.name} ({self.ingredient.measurement_unit})'
+            f' - {self.amount}'
+        )
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import posixpath
+import time
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, именующее файлы по SHA-256 содержимого: одинаковые
+    файлы сохраняются один раз и используются несколькими записями.
+    """
+
+    def get_content_name(self, name, content):
+        """Имя файла по хэшу содержимого в каталоге исходного имени"""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return posixpath.join(
+            posixpath.dirname(name),
+            digest.hexdigest() + os.path.splitext(name)[1].lower(),
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            # свежая дата защищает файл от удаления как неиспользуемого
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+    def is_stale(self, name, grace):
+        """Файл не изменялся дольше grace секунд"""
+        return time.time() - self.get_modified_time(name).timestamp() > grace
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -6,7 +6,9 @@ from .models import Follow, User
 
 @admin.register(User)
 class UserAdmin(UserAdmin):
-    list_display = ('id', 'username', 'first_name', 'last_name', 'email',)
+    list_display = (
+        'id', 'username', 'first_name', 'last_name', 'email', 'recipes_count',
+    )
     list_filter = ('email', 'first_name')
     empty_value_display = '-пусто-'
 
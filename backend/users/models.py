@@ -28,6 +28,11 @@ class User(AbstractUser):
         blank=True,
         verbose_name='Фамилия'
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
 
     @property
     def is_user(self):
@@ -60,6 +65,12 @@ class Follow(models.Model):
 
     class Meta:
         ordering = ['-id']
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'author'],
@@ -1,4 +1,5 @@
-from django.db.models import Count
+from django.db.models import (OuterRef, Prefetch, Subquery, Value,
+                              prefetch_related_objects)
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status
@@ -8,6 +9,7 @@ from rest_framework.response import Response
 
 from api.pagination import SetCustomPagination
 from api.serializers import FollowSerializer, UsersSerializer
+from recipes.models import Recipe
 from users.models import Follow, User
 
 
@@ -56,12 +58,33 @@ class UsersViewSet(UserViewSet):
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(following__user=user)
-        queryset.annotate(recipes_count=Count('recipes'))
+        queryset = self.get_subscriptions_queryset(request.user)
         pages = self.paginate_queryset(queryset)
+        prefetch_related_objects(pages, Prefetch(
+            'recipes',
+            queryset=self.get_limited_recipes(
+                request.query_params.get('recipes_limit')
+            ),
+            to_attr='limited_recipes',
+        ))
         serializer = FollowSerializer(
             pages,
             many=True,
             context={'request': request})
         return self.get_paginated_response(serializer.data)
+
+    def get_subscriptions_queryset(self, user):
+        return User.objects.filter(following__user=user).annotate(
+            is_subscribed=Value(True),
+        ).order_by('username')
+
+    def get_limited_recipes(self, limit):
+        """Первые limit рецептов каждого автора одним запросом"""
+        recipes = Recipe.objects.all()
+        if limit and limit.isdigit():
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:int(limit)]
+            ))
+        return recipes